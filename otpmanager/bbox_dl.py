@@ -1,23 +1,95 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import datetime
+import functools
 import glob
 import json
-import multiprocessing
 import os
 import requests
+import shutil
 import sys
-import tempfile
+import urllib.parse
+
+# orjson parses API responses a few times faster than the stdlib json module
+# and accepts bytes directly, but it is an optional dependency
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # Describes whether or not existing files will be overwritten
 OVERWRITE = True
 
-# How many threads to use to download GTFS feeds in parallel (use 1 for no
-# multiprocessing)
-THREADS = 4
+# Where transit.land feed listings and their ETags are cached between runs, so
+# that repeat queries can be answered with a ~200 byte 304 response
+FEED_CACHE_PATH = os.path.expanduser("~/.cache/otpmanager/feeds.json")
+
+# How many bytes to copy from the network to disk at a time
+CHUNK_SIZE = 1 << 17
+
+# Size of the userspace buffer on the output file, so that disk writes happen
+# about once per MiB rather than once per chunk
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Shared session so that DNS lookups, TCP connections, and TLS handshakes are
+# reused across downloads instead of being redone for every request
+SESSION = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections = 16,
+    pool_maxsize = 16,
+    max_retries = requests.adapters.Retry(total = 3, backoff_factor = 0.3)
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# Maximum number of threads to use to download GTFS feeds in parallel (use 1
+# for no parallelism); the actual number of threads is capped at the number of
+# feeds to be downloaded
+THREADS = 16
+
+def open_output(output_path, overwrite):
+    """ Open an output file for writing, resolving filename collisions
+
+    With overwrite disabled, candidates are opened in exclusive-creation
+    mode, so detecting a collision and creating the file happen in one atomic
+    syscall; .n is appended to the desired path, with n incrementing, until a
+    candidate is free.
+
+    Args:
+        output_path: A string containing the desired output path.
+        overwrite: A bool describing whether or not existing files will be
+            overwritten.
+
+    Returns:
+        A writable binary file object; its name attribute contains the path
+        that was actually opened.
+    """
+
+    if (overwrite):
+        # os.access asks the one question we have (does this exist?) without
+        # materializing a full stat result like os.path.exists does
+        if (os.access(output_path, os.F_OK)):
+            print("Overwriting existing file")
+        return open(output_path, "wb", buffering = WRITE_BUFFER_SIZE)
+
+    base, extension = os.path.splitext(output_path)
+    candidate = output_path
+    i = 1
+
+    while (True):
+        try:
+            f = open(candidate, "xb", buffering = WRITE_BUFFER_SIZE)
+            if (candidate != output_path):
+                print("%s exists; renaming to %s" % (output_path, candidate))
+            return f
+        except FileExistsError:
+            candidate = "%s.%d%s" % (base, i, extension)
+            i += 1
 
 def save_file(url, output_path, live_output = True, overwrite = OVERWRITE,
-              desired_extension = None):
+              desired_extension = None, min_size = None):
     """ Save a URL to a file
 
     Args:
@@ -28,6 +100,10 @@ def save_file(url, output_path, live_output = True, overwrite = OVERWRITE,
             transferred will be shown in real time.
         overwrite: A bool describing whether or not existing files will be
             overwritten.
+        min_size: A number describing the minimum expected size of the file in
+            bytes, or None for no minimum. If the server advertises a
+            Content-Length below this, the download is aborted before
+            anything is written.
 
     Returns:
         True if the download succeeds, False if the download fails.
@@ -36,7 +112,7 @@ def save_file(url, output_path, live_output = True, overwrite = OVERWRITE,
     print(url)
 
     try:
-        response = requests.get(url, stream = True)
+        response = SESSION.get(url, stream = True)
     except:
         print("=> Download failed: %s" % url)
         return False
@@ -52,44 +128,52 @@ def save_file(url, output_path, live_output = True, overwrite = OVERWRITE,
             output_path = desired_output_path
 
     if (response.status_code == 200):
+        # A malformed Content-Length is treated the same as an absent one
+        try:
+            expected_size = int(response.headers.get("Content-Length", "0"))
+        except ValueError:
+            expected_size = 0
+
+        # If the server already knows the payload is too small, bail out
+        # before writing anything
+        if (min_size is not None):
+            if (0 < expected_size < min_size):
+                print("=> Expected size %d is smaller than %s bytes" % (
+                    expected_size, min_size
+                ))
+                return False
 
         # urls with a forward slash at the end might not have a valid file name
         # assigned by transitland_dl
         if (os.path.isdir(output_path)):
             output_path += "untitled"
 
-        if (overwrite):
-            if (os.path.exists(output_path)):
-                print("Overwriting existing file")
-        else:
-            # Bruteforce for a unique filename - append .n until x.n is
-            # available, where x is the desired output path and n is an
-            # incrementing integer
-            orig_path_list = output_path.split(".")
-            i = 1
-
-            while (os.path.exists(output_path)):
-                orig_path = output_path
-                output_path = ".".join(
-                    orig_path_list[:-1] + [str(i), orig_path_list[-1]]
-                )
-                print("%s exists; renaming to %s" % (
-                    orig_path, output_path
-                ))
-                i += 1
-
         try:
-            with open(output_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size = 512):
-                    if (chunk):
-                        f.write(chunk)
-                        if (live_output):
-                            sys.stdout.write("\r=> %s (%dkb)" % (output_path,
-                                                                 f.tell()/1024))
-                            sys.stdout.flush()
-                sys.stdout.write("\r=> %s (%dkb)" % (output_path,
-                                                     f.tell()/1024))
-                sys.stdout.flush()
+            with open_output(output_path, overwrite) as f:
+                output_path = f.name
+
+                # Reserve the full extent up front to cut filesystem metadata
+                # churn on large files
+                if (expected_size > 0 and hasattr(os, "posix_fallocate")):
+                    os.posix_fallocate(f.fileno(), 0, expected_size)
+                # Stream straight from the underlying urllib3 response so the
+                # copy loop runs in C instead of re-entering the interpreter
+                # once per chunk
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, f, length = CHUNK_SIZE)
+
+                # Content-Length counts encoded bytes, but the copy above
+                # wrote the decoded body; trim the preallocation's
+                # zero-filled tail when the decoded body came up shorter
+                if (expected_size > 0):
+                    f.truncate()
+
+                # Only format the size report when somebody is watching;
+                # pipelines skip it entirely
+                if (live_output and sys.stdout.isatty()):
+                    sys.stdout.write("=> %s (%dkb)" % (output_path,
+                                                       f.tell()/1024))
+                    sys.stdout.flush()
             print("")
 
             return True
@@ -101,14 +185,75 @@ def save_file(url, output_path, live_output = True, overwrite = OVERWRITE,
     print("=> Download failed: %s" % url)
     return False
 
-def save_file_mp_wrapper(task):
-    """ Wrapper for save_file
+@functools.lru_cache(maxsize = None)
+def feed_output_path(output_directory, url):
+    """ Build the local path that a feed URL will be downloaded to
+
+    Args:
+        output_directory: A string describing the directory that the feed will
+            be saved in.
+        url: A string containing the URL of the feed.
 
-    Passes arguments into save_file
+    Returns:
+        A string containing the path to save the feed to.
     """
-    success = save_file(**task["args"])
-    if (success):
-        tempfile.mkstemp(dir = task["counter_dir"])
+
+    return os.path.join(
+        output_directory,
+        os.path.basename(urllib.parse.urlsplit(url).path) or "untitled"
+    )
+
+def query_feeds(url):
+    """ Query a transit.land feeds URL, revalidating a cached listing
+
+    Sends the cached ETag for this URL as If-None-Match; if the server
+    responds with a 304, the cached feed listing is reused instead of
+    re-downloading and re-parsing the full payload.
+
+    Args:
+        url: A string containing the transit.land feeds URL to query.
+
+    Returns:
+        The parsed feed listing, or None if the query failed.
+    """
+
+    # A missing or corrupt cache (e.g. from a crash mid-write) just means
+    # starting over with an empty one
+    try:
+        with open(FEED_CACHE_PATH, "rb") as f:
+            cache = json_loads(f.read())
+    except (OSError, ValueError):
+        cache = {}
+
+    headers = {"Accept-Encoding": "gzip, deflate"}
+    cached = cache.get(url)
+    if (cached is not None):
+        headers["If-None-Match"] = cached["etag"]
+
+    response = SESSION.get(url, headers = headers)
+
+    if (response.status_code == 304):
+        print("Feed listing unchanged; using cached copy")
+        return cached["data"]
+
+    if (response.status_code == 200):
+        data = json_loads(response.content)
+
+        etag = response.headers.get("ETag")
+        if (etag is not None):
+            cache[url] = {"etag": etag, "data": data}
+            os.makedirs(os.path.dirname(FEED_CACHE_PATH), exist_ok = True)
+
+            # Write to a temporary file and swap it into place, so a crash
+            # mid-write can never leave a truncated cache behind
+            temp_path = FEED_CACHE_PATH + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(temp_path, FEED_CACHE_PATH)
+
+        return data
+
+    return None
 
 def transitland_dl(output_directory, left, bottom, right, top, dryrun = False):
     """ Simple interface for the the transit.land
@@ -127,77 +272,75 @@ def transitland_dl(output_directory, left, bottom, right, top, dryrun = False):
             not downloaded. Nothing is returned if dryrun is True.
 
     Returns:
-        The number of GTFS feeds downloaded, or False if none were.
+        The number of GTFS feeds downloaded; False if the query succeeded
+        but no feeds exist for this bounding box; or None if the query or
+        all of the downloads failed. Callers caching a "no feeds" answer
+        must not conflate it with the None failure case.
     """
     url = "https://transit.land/api/v1/feeds?bbox=%f,%f,%f,%f" % (left, bottom,
                                                                   right, top)
     print("Querying transit.land for feeds:")
     print(url)
-    response = requests.get(url)
-    if (response.status_code == 200):
-        data = json.loads(response.content.decode())
-
-        # There should be at least 1 feed
-        if (len(data["feeds"]) > 0):
-            downloaded_feeds = 0
-            if (dryrun):
-                print("\n".join(data["feeds"]))
-                downloaded_feeds = len(data["feeds"])
-            else:
-                if (not os.path.isdir(output_directory)):
-                    os.mkdir(output_directory)
-
-                # Use multiprocessing to download GTFS feeds in parallel if
-                # THREADS > 1
-                if (THREADS > 1):
-                    print("\nUsing multiprocessing: %d parallel downloads\n" %
-                          THREADS)
-                    # Hacky way of tracking completed downloads: create a temporary
-                    # directoy in /tmp/ and add files to it when downloads finish
-                    # successfully; we can find how many downloads finished
-                    # successfully by counting the number of items in this directory
-                    counter_dir = tempfile.TemporaryDirectory(prefix = "bbox_dl")
-                    tasks = [{
-                        "counter_dir": counter_dir.name,
-                        "args": {
-                            "url": feed["url"],
-                            "output_path": "%s/%s" % (
-                                output_directory,
-                                feed["url"].split("/")[-1]
-                            ),
-                            "desired_extension": "zip",
-                            "live_output": False,
-                            "overwrite": False
-                        },
-                    } for feed in data["feeds"]]
-
-                    pool = multiprocessing.Pool(THREADS)
-                    pool.map(save_file_mp_wrapper, tasks)
-                    pool.close()
-                    pool.join()
-
-                    downloaded_feeds = len(os.listdir(counter_dir.name))
-                    counter_dir.cleanup()
-
-                # Single threaded
-                else:
-                    for feed in data["feeds"]:
-                        success = save_file(
-                            url = feed["url"],
-                            output_path = "%s/%s" % (
-                                output_directory,
-                                feed["url"].split("/")[-1]
-                            ),
-                            desired_extension = "zip"
-                        )
-                        if (success):
-                            downloaded_feeds += 1
-
-            if (downloaded_feeds > 0):
-                return downloaded_feeds
+    data = query_feeds(url)
+    if (data is None):
+        print("=> Failed")
+        return None
+
+    # There should be at least 1 feed
+    if (len(data["feeds"]) == 0):
+        print("=> No feeds found for this bounding box")
+        return False
+
+    downloaded_feeds = 0
+    if (dryrun):
+        print("\n".join(data["feeds"]))
+        downloaded_feeds = len(data["feeds"])
+    else:
+        if (not os.path.isdir(output_directory)):
+            os.mkdir(output_directory)
+
+        # Download GTFS feeds in parallel threads if THREADS > 1;
+        # downloads are I/O-bound, so threads avoid the process spawn
+        # and pickling overhead of a process pool
+        if (THREADS > 1):
+            print("\nUsing threading: %d parallel downloads\n" %
+                  THREADS)
+            tasks = [
+                (feed["url"], feed_output_path(output_directory,
+                                               feed["url"]))
+                for feed in data["feeds"]
+            ]
+
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers = min(len(tasks), THREADS)
+            ) as executor:
+                results = executor.map(
+                    lambda task: save_file(
+                        task[0], task[1], live_output = False,
+                        overwrite = False, desired_extension = "zip"
+                    ),
+                    tasks
+                )
+
+            downloaded_feeds = sum(bool(result) for result in results)
+
+        # Single threaded
+        else:
+            for feed in data["feeds"]:
+                success = save_file(
+                    url = feed["url"],
+                    output_path = feed_output_path(output_directory,
+                                                   feed["url"]),
+                    desired_extension = "zip"
+                )
+                if (success):
+                    downloaded_feeds += 1
+
+    if (downloaded_feeds > 0):
+        return downloaded_feeds
 
     print("=> Failed")
-    return False
+    return None
 
 def overpass_dl(output_path, left, bottom, right, top, ways_only = False,
                 min_size = 10e3, dryrun = False):
@@ -234,9 +377,11 @@ def overpass_dl(output_path, left, bottom, right, top, ways_only = False,
     if (dryrun):
         print(url)
     else:
-        if (save_file(url, output_path)):
+        if (save_file(url, output_path, min_size = min_size)):
             if (os.stat(output_path).st_size < min_size):
                 print("Downloaded OSM file is smaller than %s bytes" % min_size)
                 return False
             else:
                 return True
+        else:
+            return False
@@ -1,30 +1,73 @@
 #!/usr/bin/env python3
 
 import atexit
+import collections
+import concurrent.futures
 import contextlib
 import datetime
-import glob
+import functools
+import hashlib
 import json
 import os
+import queue
+import re
+import selectors
+import signal
 import socket
 import subprocess
+import sys
+import threading
 import time
 import zipfile
 
 from . import bbox_dl
 
+# orjson handles the graph config a few times faster than the stdlib json
+# module, but it is an optional dependency; orjson.dumps returns bytes, so
+# the write mode has to follow the serializer
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+    _CONFIG_WRITE_MODE = "wb"
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+    _CONFIG_WRITE_MODE = "w"
+
 # Array containing ports that can be used by this script
 DEFAULT_PORT_ALLOCATION_RANGE = range(8100, 8200)
 
 # Characters to be replaced by "_"
 ILLEGAL_CHARACTERS = ["(", ")", "?"]
 
+# Translation table mapping each illegal character to "_"
+_ILLEGAL_CHARACTER_TABLE = str.maketrans(
+    {character: "_" for character in ILLEGAL_CHARACTERS}
+)
+
 # Name of the file to be stored in each graph directory containing info about
 # otpmanager's build progress
 CONFIG_FILENAME = "otpmanager.json"
 
+# Name of the file in graph_root_dir recording bounding boxes for which
+# transit.land returned no feeds, so repeat runs over transit-free regions
+# can skip the query
+GTFS_NEG_CACHE_FILENAME = "gtfs_neg_cache.json"
+
+# How long, in seconds, a no-feeds-found result is trusted before the
+# bounding box is queried again
+GTFS_NEG_CACHE_TTL = 24 * 60 * 60
+
 DEFAULT_PORT = 8080
 
+# Pre-resolved loopback address; connecting to the literal address skips a
+# getaddrinfo lookup per probe
+LOCALHOST = "127.0.0.1"
+
+# Close probe sockets on exec so they don't leak into launched JVMs
+_PROBE_SOCKET_TYPE = socket.SOCK_STREAM | getattr(socket, "SOCK_CLOEXEC", 0)
+
 # Directory to store graphs in
 DEFAULT_GRAPH_ROOT_DIR = "graphs/"
 
@@ -32,21 +75,65 @@ DEFAULT_GRAPH_ROOT_DIR = "graphs/"
 # considered to be dead
 DEFAULT_TIMEOUT = 600
 
+# How many bytes to pull off the subprocess pipe per read; a single read can
+# carry many lines when the routing engine is chatty
+PIPE_READ_SIZE = 1 << 16
+
+# In-memory cache of parsed graph config files, keyed by path, so that
+# repeated start() calls do not re-read and re-parse the same JSON
+_CONFIG_CACHE = {}
+
+# Compiled form of a monitor_proc listener dict; attribute loads are cheaper
+# than the repeated key-membership probes the dicts needed
+_Listener = collections.namedtuple(
+    "_Listener", ["substring", "kill_otp", "return_value", "callback"]
+)
+
+# Sentinel telling a listener with no return value apart from one that
+# returns None
+_NO_RETURN_VALUE = object()
+
 def log_name(label):
     """ Create a timestamped log filename given a label """
 
-    return "%s_%s.log" % (label, datetime.datetime.now().isoformat())
+    # time.strftime is a single C call, unlike datetime construction +
+    # isoformat; the nanosecond suffix keeps names unique within a second
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{label}_{timestamp}.{time.time_ns() % 10 ** 9:09d}.log"
 
+@functools.lru_cache(maxsize = 256)
 def remove_illegal_characters(string):
     """ Remove illegal file path characters from a string """
-    for character in ILLEGAL_CHARACTERS:
-        string = string.replace(character, "_")
-    return string
+    return string.translate(_ILLEGAL_CHARACTER_TABLE)
+
+def first_file_with_suffix(directory, suffix):
+    """ Find the first file in a directory whose name ends with a suffix
+
+    Args:
+        directory: The directory to search in.
+        suffix: The filename suffix to look for.
+
+    Returns:
+        A string containing the path of the first matching file.
+
+    Raises:
+        FileNotFoundError: If the directory contains no matching file.
+    """
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if (entry.name.endswith(suffix)):
+                return entry.path
+
+    raise FileNotFoundError("No *%s file in %s" % (suffix, directory))
 
 def port_available(port):
     """ Find if a port is in use
 
-    From http://stackoverflow.com/a/35370008
+    Probes by binding rather than connecting: a connect probe reports "free"
+    for ports that merely have no loopback listener, while what we actually
+    need to know is whether a routing engine could bind here. Binding is also
+    a single syscall with no TCP handshake.
 
     Args:
         port: The port to be checked.
@@ -55,31 +142,146 @@ def port_available(port):
         True if the port is available; False if it is in use.
     """
 
-    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
-        if sock.connect_ex(("localhost", port)) == 0:
-            return False
-        else:
+    with contextlib.closing(socket.socket(socket.AF_INET,
+                                          _PROBE_SOCKET_TYPE)) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(("", port))
+            sock.listen(1)
             return True
+        except OSError:
+            return False
+
+def _listening_ports():
+    """ Collect every locally-bound TCP port from the kernel's socket tables
+
+    Reading /proc/net/tcp and /proc/net/tcp6 costs two file reads no matter
+    how many candidate ports are being considered, where probing costs a
+    socket and a connection attempt per candidate. The local port is the hex
+    field after the colon in each row's local-address column.
+
+    Returns:
+        A set of port numbers that have a local TCP socket in any state, or
+        None if the tables are unavailable (i.e. not on Linux).
+    """
+
+    ports = set()
+    readable = False
+
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, "rb") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        readable = True
 
-def find_ports(port_range, num_ports = 2):
+        # The first line is the column header
+        for line in lines[1:]:
+            fields = line.split()
+            if (len(fields) > 1):
+                ports.add(int(fields[1].split(b":")[1], 16))
+
+    if (readable):
+        return ports
+    return None
+
+def find_ports(port_range, num_ports = 2, timeout = 0.2):
     """ Find available ports in the given range
 
+    On Linux, the whole range is checked against a single read of the
+    kernel's socket tables; elsewhere, a non-blocking connection attempt is
+    issued to every port in the range at once and the results are reaped
+    through a single selector wait.
+
     Args:
         port_range: The range of possible ports to use.
         num_ports: The number of ports that must be found and returned.
+        timeout: How long, in seconds, to wait for the connection attempts to
+            resolve, when probing is used.
 
     Returns:
-        An integer of the first available port or False if all ports are in use.
-
+        A list of the lowest available ports, or False if not enough ports
+        are available.
     """
-    results = []
-    for port in port_range:
-        if (port_available(port)):
-            results.append(port)
-        if (len(results) == num_ports):
+
+    listening = _listening_ports()
+    if (listening is not None):
+        results = [port for port in port_range
+                   if (port not in listening)][:num_ports]
+        if (len(results) >= num_ports):
             return results
+        return False
+
+    selector = selectors.DefaultSelector()
+    sockets = []
+    results = []
+
+    try:
+        for port in port_range:
+            sock = socket.socket(socket.AF_INET, _PROBE_SOCKET_TYPE)
+            sock.setblocking(False)
+            sock.connect_ex((LOCALHOST, port))
+            sockets.append(sock)
+            selector.register(sock, selectors.EVENT_WRITE, port)
+
+        deadline = time.monotonic() + timeout
+        while (selector.get_map()):
+            remaining = deadline - time.monotonic()
+            if (remaining <= 0):
+                break
+            events = selector.select(timeout = remaining)
+            for key, dummy_mask in events:
+                selector.unregister(key.fileobj)
+
+                # A connection error means that nothing is listening on that
+                # port, so it is free for us to use
+                error = key.fileobj.getsockopt(socket.SOL_SOCKET,
+                                               socket.SO_ERROR)
+                if (error != 0):
+                    results.append(key.data)
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+
+    if (len(results) >= num_ports):
+        results.sort()
+        return results[:num_ports]
     return False
 
+def _echo_output(out_queue):
+    """ Echo queued subprocess output to STDOUT in batches
+
+    Runs on a background thread so that a slow or blocked terminal never
+    stalls the thread draining the subprocess pipe. Everything queued since
+    the last wakeup goes out as a single write; a None in the queue ends the
+    thread.
+
+    Args:
+        out_queue: The queue.SimpleQueue that lines are fed through.
+    """
+
+    done = False
+    while (not done):
+        line = out_queue.get()
+        if (line is None):
+            break
+
+        batch = [line]
+        while (True):
+            try:
+                line = out_queue.get_nowait()
+            except queue.Empty:
+                break
+            if (line is None):
+                done = True
+                break
+            batch.append(line)
+
+        sys.stdout.write("".join(batch))
+        sys.stdout.flush()
+
 def print_wide(string, columns = 80, padding = "="):
     """ Print a string taking up the number of columns specified
 
@@ -88,8 +290,11 @@ def print_wide(string, columns = 80, padding = "="):
         columns: The number of columns to take up.
         padding: The character to be used to pad the empty columns.
     """
-    before = "%s %s " % (padding * 2, string)
-    print("%s%s" % (before, padding * (columns - len(before))))
+
+    # str.ljust fills the remaining columns in a single C-level call
+    sys.stdout.write(
+        ("%s %s " % (padding * 2, string)).ljust(columns, padding) + "\n"
+    )
 
 class JavaManager(object):
     """ Generic class containing functions to assist in the setting up,
@@ -133,20 +338,46 @@ class JavaManager(object):
 
         self.proc = None
         self.proc_output = None
-        self.graph_subdir = None
-        self.graph_config_path = None
+        self.log = None
+
+        # These paths only depend on constructor arguments, so they are
+        # computed once here instead of on every setup pass
+        self.graph_subdir = os.path.join(self.graph_root_dir,
+                                         self.graph_name) + os.sep
+        self.graph_config_path = os.path.join(self.graph_subdir,
+                                              CONFIG_FILENAME)
+
         self.graph_config = None
+        self._last_written_config = None
+        self._atexit_registered = False
 
     def write_config(self):
-        with open(self.graph_config_path, "w") as f:
-            json.dump(self.graph_config, f)
+        """ Write the graph config to disk, skipping writes that would not
+        change the file
+
+        The config is written to a temporary file and swapped into place
+        with os.replace, so a crash mid-write can never leave a truncated
+        config behind.
+        """
+
+        serialized = json_dumps(self.graph_config)
+        if (serialized == self._last_written_config):
+            return
 
-    def monitor_proc(self, listeners = [], show_output = True,
+        temp_path = self.graph_config_path + ".tmp"
+        with open(temp_path, _CONFIG_WRITE_MODE) as f:
+            f.write(serialized)
+        os.replace(temp_path, self.graph_config_path)
+
+        self._last_written_config = serialized
+        _CONFIG_CACHE[self.graph_config_path] = self.graph_config
+
+    def monitor_proc(self, listeners = None, show_output = True,
                     timeout = DEFAULT_TIMEOUT):
         """ Monitor the running process
 
-        Monitor the output of a running process and perform actions if
-        necessary.
+        Block on the running process's stdout pipe, tee its output into
+        self.log, and perform actions if necessary.
 
         Args:
             listeners: A list of dictionaries, structured as such:
@@ -174,41 +405,130 @@ class JavaManager(object):
 
         """
 
-        last_activity = time.time()
+        # An immutable default sidesteps the shared-mutable-argument footgun
+        if (listeners is None):
+            listeners = ()
+
+        # time.monotonic is cheaper than time.time on some platforms and
+        # never jumps backwards under clock adjustments
+        last_activity = time.monotonic()
+
+        # Compile the listener dicts once, outside the hot loop
+        compiled = [
+            _Listener(
+                listener["substring"],
+                listener.get("kill_otp", False),
+                listener.get("return_value", _NO_RETURN_VALUE),
+                listener.get("callback", None)
+            )
+            for listener in listeners
+        ]
 
-        with open(self.proc_output, "r") as otp_output:
+        # Precompile the listener substrings into one alternation so each
+        # line is scanned once at C level instead of once per listener;
+        # match.lastindex identifies which listener fired. The pattern is
+        # compiled as bytes because the pipe is read as bytes: lines go from
+        # the pipe to the log and the matcher without ever being decoded
+        pattern = None
+        if (compiled):
+            pattern = re.compile(b"|".join(
+                b"(%s)" % re.escape(listener.substring.encode())
+                for listener in compiled
+            ))
+
+        # The pipe is drained with os.read in PIPE_READ_SIZE chunks rather
+        # than line by line, so a burst of JVM output costs one syscall
+        # instead of one per line; partial trailing lines are carried over
+        # in `pending` until their newline arrives
+        stdout_fd = self.proc.stdout.fileno()
+        os.set_blocking(stdout_fd, False)
+        pending = b""
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.proc.stdout, selectors.EVENT_READ)
+
+        # Echoed output is handed to a background writer thread, so the
+        # loop below never blocks on the terminal while the pipe has data;
+        # the writer batches whatever has queued up into single writes
+        out_queue = None
+        writer = None
+        if (show_output):
+            out_queue = queue.SimpleQueue()
+            writer = threading.Thread(target = _echo_output,
+                                      args = (out_queue,), daemon = True)
+            writer.start()
+
+        try:
             while (self.proc is not None):
-                line = otp_output.readline().rstrip()
 
-                if (len(line) > 0):
-                    last_activity = time.time()
+                # Block until the process emits output, waking up at most
+                # once per timeout window instead of polling
+                if (timeout is not False):
+                    remaining = timeout - (time.monotonic() - last_activity)
+                    if (remaining <= 0):
+                        print("\nKilling OTP; no stdout/stderr activity "
+                              "in last %d seconds" % timeout)
+                        self.terminate()
+                        return False
+                    events = selector.select(timeout = remaining)
+                else:
+                    events = selector.select()
 
-                    if (show_output):
-                        print(">> %s" % line)
-
-                    for listener in listeners:
-                        if (listener["substring"] in line):
-                            if ("kill_otp" in listener):
-                                if (listener["kill_otp"]):
-                                    time.sleep(1)
-                                    self.terminate()
-                            if ("return_value" in listener):
-                                return listener["return_value"]
-                            if ("callback" in listener):
-                                listener["callback"]()
-                            return
+                if (not events):
+                    continue
 
-                else:
-                    if (timeout is not False):
-                        if (time.time() - last_activity > timeout):
-                            print("\nKilling OTP; no stdout/stderr activity "
-                                  "in last %d seconds" % timeout)
-                            self.terminate()
-                            return False
+                chunk = os.read(stdout_fd, PIPE_READ_SIZE)
 
-                    time.sleep(0.1)
+                # An empty read from a pipe means the process closed its
+                # output stream, i.e. it exited; reap it immediately rather
+                # than waiting out the timeout. Any partial trailing line is
+                # already in the log, since chunks are teed whole below
+                if (len(chunk) == 0):
+                    returncode = self.proc.wait()
+                    print("Process exited with code %s" % returncode)
+                    self.proc = None
+                    return False
+
+                # The whole chunk is teed into the log in one write
+                if (self.log is not None):
+                    self.log.write(chunk)
+
+                last_activity = time.monotonic()
+
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+
+                for line in lines:
+                    line = line.rstrip()
+                    if (len(line) == 0):
+                        continue
+
+                    if (show_output):
+                        # Decoding is deferred to here, so suppressed output
+                        # is never decoded at all
+                        out_queue.put(">> %s\n" % line.decode(
+                            errors = "replace"
+                        ))
+
+                    if (pattern is not None):
+                        match = pattern.search(line)
+                        if (match is not None):
+                            listener = compiled[match.lastindex - 1]
+                            if (listener.kill_otp):
+                                time.sleep(1)
+                                self.terminate()
+                            if (listener.return_value is not _NO_RETURN_VALUE):
+                                return listener.return_value
+                            if (listener.callback is not None):
+                                listener.callback()
+                            return
 
             print("Terminating monitor loop...")
+        finally:
+            if (out_queue is not None):
+                out_queue.put(None)
+                writer.join()
+            selector.close()
 
     def download_osm(self, output_dir, **overpass_dl_kwargs):
         """ Wrapper for bbox_dl.overpass_dl
@@ -221,11 +541,10 @@ class JavaManager(object):
             True if the OSM file was downloaded; False if otherwise.
         """
 
+        # time_ns gives a unique tag in one call, with no local-time
+        # conversion and no ":" characters to trip up other filesystems
         osm = bbox_dl.overpass_dl(
-            "%s/map-%s.osm" % (
-                output_dir,
-                datetime.datetime.now().isoformat()
-            ),
+            os.path.join(output_dir, "map-%d.osm" % time.time_ns()),
             *self.bbox,
             **overpass_dl_kwargs
         )
@@ -239,6 +558,10 @@ class JavaManager(object):
     def download_gtfs(self, output_dir):
         """ Wrapper for bbox_dl.transitland_dl
 
+        A "no feeds found" answer is remembered per bounding box in
+        graph_root_dir for GTFS_NEG_CACHE_TTL seconds, so repeat runs over a
+        transit-free region skip the transit.land round trip entirely.
+
         Args:
             output_dir: A string containing the path to the directory to store
                 the GTFS feeds in.
@@ -248,24 +571,206 @@ class JavaManager(object):
             otherwise.
         """
 
+        cache_path = os.path.join(self.graph_root_dir,
+                                  GTFS_NEG_CACHE_FILENAME)
+        key = "%f,%f,%f,%f" % self.bbox
+
+        try:
+            with open(cache_path, "rb") as f:
+                cache = json_loads(f.read())
+        except (FileNotFoundError, ValueError):
+            cache = {}
+
+        cached_at = cache.get(key)
+        if ((cached_at is not None)
+                and (time.time() - cached_at < GTFS_NEG_CACHE_TTL)):
+            print("No GTFS feeds found for this bounding box recently; "
+                  "not retrying yet")
+            return False
+
         gtfs = bbox_dl.transitland_dl("%s" % output_dir, *self.bbox)
         print("Downloaded GTFS: %s" % str(gtfs))
 
-        if (gtfs is not False):
-            return True
-
-        return False
+        # Only a successful query that genuinely found no feeds is cached;
+        # transitland_dl returns None for query/download failures, which
+        # are transient and must stay retryable
+        dirty = False
+        if (gtfs is False):
+            cache[key] = time.time()
+            dirty = True
+        elif (gtfs):
+            if (key in cache):
+                del cache[key]
+                dirty = True
+
+        if (dirty):
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, _CONFIG_WRITE_MODE) as f:
+                f.write(json_dumps(cache))
+            os.replace(temp_path, cache_path)
+
+        return bool(gtfs)
 
     def terminate(self, *dummy_args, **dummy_kwargs):
-        """ Terminate the running process """
+        """ Terminate the running process
+
+        Asks the process to exit with SIGTERM first, giving the JVM a chance
+        to flush logs and release its ports, and escalates to SIGKILL only
+        if it has not exited within a few seconds.
+        """
 
         if (self.proc is not None):
-            print("Killing process %d" % self.proc.pid)
-            self.proc.kill()
+            print("Terminating process %d" % self.proc.pid)
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout = 5)
+            except subprocess.TimeoutExpired:
+                print("Process %d did not exit; killing" % self.proc.pid)
+                self.proc.kill()
+                self.proc.wait()
             self.proc = None
         else:
             print("No running process to kill")
 
+    def close_log(self):
+        """ Close the current log file, if one is open """
+
+        if (self.log is not None):
+            self.log.close()
+            self.log = None
+
+    def _drain_log(self, proc, log):
+        """ Tee a running process's remaining output into its log file
+
+        Runs on a background thread after monitor_proc has returned with the
+        process still alive (a successful server launch): without a reader,
+        the pipe buffer would fill and the process would block on its next
+        write. The thread owns the log and closes it at EOF.
+
+        Args:
+            proc: The subprocess.Popen whose stdout pipe to drain.
+            log: The open log file to tee output into.
+        """
+
+        stdout_fd = proc.stdout.fileno()
+        os.set_blocking(stdout_fd, True)
+
+        while (True):
+            try:
+                chunk = os.read(stdout_fd, PIPE_READ_SIZE)
+            except OSError:
+                break
+            if (len(chunk) == 0):
+                break
+            log.write(chunk)
+
+        log.close()
+
+    def allocate_ports(self, port, dynamically_allocate_ports,
+                       port_allocation_range, num_ports = 2):
+        """ Choose the ports for the routing engine to use
+
+        Args:
+            port: The port to serve on when ports are not dynamically
+                allocated.
+            dynamically_allocate_ports: If True, overrides the port argument
+                and instead chooses the first available ports from
+                port_allocation_range.
+            port_allocation_range: A list of ports that can be used.
+            num_ports: The number of ports to allocate.
+
+        Returns:
+            A list of ports, the first of which is also stored in self.port,
+            or False if not enough ports are available.
+        """
+
+        if (dynamically_allocate_ports):
+            ports = find_ports(port_allocation_range, num_ports)
+            if (not ports):
+                print("No ports between %d and %d are available." % (
+                    port_allocation_range[0], port_allocation_range[-1]
+                ))
+                return False
+        else:
+            # The caller supplied a port, so no port scan is needed
+            ports = [port + offset * 1000 for offset in range(num_ports)]
+
+        self.port = ports[0]
+        return ports
+
+    def launch_proc(self, argv, success_substring, label = "otpmanager",
+                    kill_on_success = False, timeout = DEFAULT_TIMEOUT):
+        """ Launch the routing engine and watch for startup success
+
+        Starts the given command with its output piped into a timestamped
+        log, then monitors it until it either prints success_substring or
+        raises an exception.
+
+        Args:
+            argv: The argument list to launch the routing engine with.
+            success_substring: A substring of the line that the routing
+                engine prints once it has finished its work.
+            label: The label to build the log filename from.
+            kill_on_success: A bool describing whether or not the process
+                should be killed once success_substring is seen, e.g. after a
+                one-shot graph build.
+            timeout: Passed through to monitor_proc.
+
+        Returns:
+            True if success_substring was seen; False otherwise.
+        """
+
+        self.proc_output = log_name(label)
+        self.log = open(self.proc_output, "wb")
+
+        # The pipe is left in binary mode: monitor_proc tees and matches raw
+        # bytes, so routing engine output never pays for a decode/re-encode
+        # round trip on its way to the log
+        self.proc = subprocess.Popen(
+            argv,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT
+        )
+        print("PID: %d" % self.proc.pid)
+
+        result = self.monitor_proc([
+            {
+                "substring": "Exception in thread",
+                "kill_otp": True,
+                "return_value": False
+            },
+            {
+                # A port grabbed between our scan and the JVM's bind should
+                # fail fast so the retry in start() can allocate fresh
+                # ports, rather than waiting out the startup timeout
+                "substring": "Address already in use",
+                "kill_otp": True,
+                "return_value": False
+            },
+            {
+                "substring": success_substring,
+                "kill_otp": kill_on_success,
+                "return_value": True
+            }
+        ], timeout = timeout)
+
+        # monitor_proc returns as soon as a listener with a return_value
+        # fires. If the process is still running at that point (a server
+        # launch), the pipe must keep being drained or the routing engine
+        # will block once the pipe buffer fills, so a background thread
+        # takes over the tee into the log and closes it at process exit;
+        # otherwise nothing writes to the log again and it is closed here
+        if (self.proc is not None):
+            drain = threading.Thread(target = self._drain_log,
+                                     args = (self.proc, self.log),
+                                     daemon = True)
+            self.log = None
+            drain.start()
+        else:
+            self.close_log()
+
+        return result
+
     def setup_graph_init(self):
         """ Stage 1 of setup: create graph subdirectories and config file
 
@@ -273,27 +778,49 @@ class JavaManager(object):
             True on successful completion
         """
 
-        self.graph_subdir = "%s/%s/" % (self.graph_root_dir, self.graph_name)
-
-        if (not os.path.exists(self.graph_root_dir)):
-            os.mkdir(self.graph_root_dir)
-        if (not os.path.exists(self.graph_subdir)):
-            os.mkdir(self.graph_subdir)
+        # Creates graph_root_dir along the way and swallows EEXIST, saving
+        # the stat-then-mkdir dance for each component
+        os.makedirs(self.graph_subdir, exist_ok = True)
 
-        self.graph_config_path = "%s/%s" % (self.graph_subdir, CONFIG_FILENAME)
-        if (os.path.exists(self.graph_config_path)):
-            with open(self.graph_config_path, "r") as f:
-                self.graph_config = json.load(f)
+        if (self.graph_config_path in _CONFIG_CACHE):
+            self.graph_config = _CONFIG_CACHE[self.graph_config_path]
         else:
-            self.graph_config = {
-                "osm_download_time": False,
-                "gtfs_download_time": False,
-                "otp_graph_build_time": False,
-                "gh_graph_build_time": False
-            }
+            # Open directly and fall back on FileNotFoundError rather than
+            # stat-ing first; saves a syscall and cannot race with anything
+            # else touching the file
+            try:
+                with open(self.graph_config_path, "rb") as f:
+                    self.graph_config = json_loads(f.read())
+            except FileNotFoundError:
+                self.graph_config = {
+                    "osm_download_time": False,
+                    "gtfs_download_time": False,
+                    "otp_graph_build_time": False,
+                    "gh_graph_build_time": False
+                }
+            _CONFIG_CACHE[self.graph_config_path] = self.graph_config
 
         return True
 
+    def data_fingerprint(self):
+        """ Fingerprint the downloaded data that graphs are built from
+
+        Hashes the names and sizes of the OSM and GTFS files in the graph
+        directory, so that a rebuild can be skipped when the inputs have not
+        changed.
+
+        Returns:
+            A string containing a hex digest of the graph input data.
+        """
+
+        digest = hashlib.sha256()
+        with os.scandir(self.graph_subdir) as entries:
+            for entry in sorted(entries, key = lambda entry: entry.name):
+                if (entry.name.endswith((".osm", ".zip"))):
+                    digest.update(entry.name.encode())
+                    digest.update(str(entry.stat().st_size).encode())
+        return digest.hexdigest()
+
     def setup_download_data(self, ways_only, min_osm_size, require_gtfs):
         """ Stage 2 of setup: download data
 
@@ -305,37 +832,71 @@ class JavaManager(object):
             True on successful completion
         """
 
-        print_wide("Downloading OSM from Overpass API")
-        if (not self.graph_config["osm_download_time"]):
-            if (self.download_osm(
-                self.graph_subdir,
-                ways_only = ways_only,
-                min_size = min_osm_size
-            )):
-                self.graph_config["osm_download_time"] = datetime.datetime.now().isoformat()
-                self.write_config()
+        # One timestamp for every stage completed in this pass
+        now = datetime.datetime.now().isoformat()
+
+        need_osm = not self.graph_config["osm_download_time"]
+        need_gtfs = not self.graph_config["gtfs_download_time"]
+
+        osm_ok = True
+        gtfs_ok = True
+
+        # Overpass and transit.land are unrelated services, so the two
+        # downloads can run at the same time
+        print_wide("Downloading OSM from Overpass API and GTFS feeds")
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers = 2
+        ) as executor:
+            osm_future = None
+            gtfs_future = None
+
+            if (need_osm):
+                osm_future = executor.submit(
+                    self.download_osm,
+                    self.graph_subdir,
+                    ways_only = ways_only,
+                    min_size = min_osm_size
+                )
+            else:
+                print("OSM already downloaded")
+
+            if (need_gtfs):
+                gtfs_future = executor.submit(
+                    self.download_gtfs, self.graph_subdir
+                )
+            else:
+                print("GTFS already downloaded")
+
+            if (osm_future is not None):
+                osm_ok = osm_future.result()
+            if (gtfs_future is not None):
+                gtfs_ok = gtfs_future.result()
+
+        if (need_osm):
+            if (osm_ok):
+                self.graph_config["osm_download_time"] = now
             else:
                 print("OSM downloading failed")
-                return False
-        else:
-            print("OSM already downloaded")
 
-        print_wide("Downloading GTFS feeds")
-        if (not self.graph_config["gtfs_download_time"]):
-            if (self.download_gtfs(self.graph_subdir)):
+        if (need_gtfs):
+            if (gtfs_ok):
                 self.using_gtfs = True
-                self.graph_config["gtfs_download_time"] = datetime.datetime.now().isoformat()
-                self.write_config()
+                self.graph_config["gtfs_download_time"] = now
             else:
                 self.using_gtfs = False
                 print("GTFS downloading failed")
 
-                if (require_gtfs):
-                    return False
-                else:
-                    print("Resuming anyway")
-        else:
-            print("GTFS already downloaded")
+        # A single config write covers both stages
+        self.write_config()
+
+        if (not osm_ok):
+            return False
+
+        if (need_gtfs and not gtfs_ok):
+            if (require_gtfs):
+                return False
+            else:
+                print("Resuming anyway")
         print("")
 
         return True
@@ -379,7 +940,28 @@ class JavaManager(object):
         if (not self.setup_download_data(ways_only, min_osm_size, require_gtfs)):
             return False
 
-        atexit.register(self.terminate)
+        # Register the cleanup handler only once per instance; repeated
+        # start() calls would otherwise queue duplicate handlers that all
+        # walk the "no running process" path at interpreter shutdown
+        if (not self._atexit_registered):
+            atexit.register(self.terminate)
+
+            # atexit does not fire on SIGTERM, so a supervisor-initiated
+            # shutdown would orphan the JVM; converting the signal into a
+            # normal exit lets the handler above run. Handlers can only be
+            # installed from the main thread, and any handler the embedding
+            # application already set is chained, not clobbered
+            if (threading.current_thread() is threading.main_thread()):
+                previous = signal.getsignal(signal.SIGTERM)
+
+                def handle_sigterm(signum, frame):
+                    if (callable(previous)):
+                        previous(signum, frame)
+                    sys.exit(128 + signum)
+
+                signal.signal(signal.SIGTERM, handle_sigterm)
+
+            self._atexit_registered = True
 
         # Defined by individual routing engine managers
         if (not self.setup_routing_engine(auto_download_jar)):
@@ -424,23 +1006,39 @@ class OTPManager(JavaManager):
                 print("No routing engine found")
                 return False
 
-        return False
-
-        # Initial graph build
+        # Initial graph build, skipped when the downloaded inputs are
+        # unchanged and the built graph is still on disk
         print_wide("Building graph")
-        if (not self.graph_config["otp_graph_build_time"]):
-            if (self.build_graph()):
-                self.graph_config["otp_graph_build_time"] = datetime.datetime.now().isoformat()
-                self.write_config()
-            else:
-                print("Graph building failed")
-                return False
-        else:
+        fingerprint = self.data_fingerprint()
+        if ((self.graph_config.get("build_fingerprint") == fingerprint)
+                and os.access(os.path.join(self.graph_subdir, "Graph.obj"),
+                              os.F_OK)):
             print("Graph already built")
+        elif (self.build_graph()):
+            self.graph_config["otp_graph_build_time"] = datetime.datetime.now().isoformat()
+            self.graph_config["build_fingerprint"] = fingerprint
+            self.write_config()
+        else:
+            print("Graph building failed")
+            return False
         print("")
 
         return True
 
+    def java_prefix(self):
+        """ The invariant head of every OTP java invocation
+
+        Built once and reused by both the graph build and the server
+        launches, mirroring how build_gh_startup_args caches its resolved
+        paths.
+        """
+
+        if (getattr(self, "_java_prefix", None) is None):
+            self._java_prefix = (
+                "java", "-jar", self.jar_path, "--basePath", "."
+            )
+        return self._java_prefix
+
     def build_graph(self):
         """ Attempts to build a graph with OTP
 
@@ -450,36 +1048,13 @@ class OTPManager(JavaManager):
             True if successful; False if not.
         """
 
-        self.proc_output = log_name("otpmanager_graph_build")
-        fp = open(self.proc_output, "w")
-
-        self.proc = subprocess.Popen(
-            [
-                "java", "-jar", self.jar_path,
-                "--basePath", ".",
-                "--build", self.graph_subdir
-            ],
-            stdout = fp,
-            stderr = fp
+        return self.launch_proc(
+            list(self.java_prefix()) + ["--build", self.graph_subdir],
+            "Graph written",
+            label = "otpmanager_graph_build",
+            kill_on_success = True
         )
 
-        print("PID: %d" % self.proc.pid)
-
-        return self.monitor_proc([
-            {
-                "substring": "Exception in thread",
-                "kill_otp": True,
-                "return_value": False,
-                "callback": fp.close
-            },
-            {
-                "substring": "Graph written",
-                "kill_otp": True,
-                "return_value": True,
-                "callback": fp.close
-            }
-        ])
-
     def start_proc(self, port, dynamically_allocate_ports,
                     port_allocation_range):
         """ Attempts to start an OTP instance
@@ -498,49 +1073,21 @@ class OTPManager(JavaManager):
             True if OTP was succesfully started; False otherwise.
         """
 
-        if (dynamically_allocate_ports):
-            ports = find_ports(port_allocation_range, 2)
-            if (ports):
-                self.port = ports[0]
-            else:
-                print("No ports between %d and %d are available." % (
-                    port_allocation_range[0], port_allocation_range[-1]
-                ))
-                return False
-        else:
-            self.port = port,
-
-        self.proc_output = log_name("otpmanager")
-        fp = open(self.proc_output, "w")
+        ports = self.allocate_ports(port, dynamically_allocate_ports,
+                                    port_allocation_range, 2)
+        if (not ports):
+            return False
 
-        self.proc = subprocess.Popen(
-            [
-                "java", "-jar", self.jar_path,
-                "--basePath", ".",
+        return self.launch_proc(
+            list(self.java_prefix()) + [
                 "--router", self.graph_name,
                 "--port", str(self.port),
                 "--securePort", str(ports[1]),
                 "--inMemory"
             ],
-            stdout = fp,
-            stderr = fp
+            "Grizzly server running",
+            timeout = False
         )
-        print("OTP PID: %d" % self.proc.pid)
-
-        return self.monitor_proc([
-            {
-                "substring": "Exception in thread",
-                "kill_otp": True,
-                "return_value": False,
-                "callback": fp.close
-            },
-            {
-                "substring": "Grizzly server running",
-                "kill_otp": False,
-                "return_value": True,
-                "callback": fp.close
-            }
-        ], timeout = False)
 
 class GraphHopperManager(JavaManager):
 
@@ -569,8 +1116,31 @@ class GraphHopperManager(JavaManager):
 
                 print("Unpacking routing engine")
                 os.mkdir(self.jar_path)
+
+                # Extract members in parallel; zlib releases the GIL during
+                # inflation, so decompression overlaps with disk writes
                 with zipfile.ZipFile(out_zip, "r") as z:
-                    z.extractall(self.jar_path)
+                    names = z.namelist()
+
+                    # Create the directory tree serially first:
+                    # ZipFile.extract's internal makedirs is a check-then-act
+                    # sequence that two threads can race into FileExistsError
+                    for name in names:
+                        dir_name = os.path.dirname(name)
+                        if (dir_name):
+                            os.makedirs(
+                                os.path.join(self.jar_path, dir_name),
+                                exist_ok = True
+                            )
+
+                    with concurrent.futures.ThreadPoolExecutor(
+                        max_workers = os.cpu_count()
+                    ) as executor:
+                        list(executor.map(
+                            lambda name: z.extract(name, self.jar_path),
+                            (name for name in names
+                             if (not name.endswith("/")))
+                        ))
                 os.remove(out_zip)
             else:
                 print("No routing engine found")
@@ -592,11 +1162,18 @@ class GraphHopperManager(JavaManager):
         return True
 
     def build_gh_startup_args(self, port = None):
+        # Resolve the jar and OSM file paths once; they do not change between
+        # the graph build and subsequent server launches
+        if (getattr(self, "_jar_file", None) is None):
+            self._jar_file = first_file_with_suffix(self.jar_path, ".jar")
+        if (getattr(self, "_osm_file", None) is None):
+            self._osm_file = first_file_with_suffix(self.graph_subdir, ".osm")
+
         args = [
-            "java", "-jar", glob.glob("%s/*.jar" % self.jar_path)[0],
+            "java", "-jar", self._jar_file,
             "jetty.resourcebase=%s/webapp" % self.jar_path,
             "config=%s/config-example.properties" % self.jar_path,
-            "datareader.file=" + glob.glob("%s/*.osm" % self.graph_subdir)[0],
+            "datareader.file=" + self._osm_file,
             "graph.flag_encoders=car,foot,bike"
         ]
         if (port):
@@ -612,32 +1189,13 @@ class GraphHopperManager(JavaManager):
             True if successful; False if not.
         """
 
-        self.proc_output = log_name("otpmanager_graph_build")
-        fp = open(self.proc_output, "w")
-
-        self.proc = subprocess.Popen(
+        return self.launch_proc(
             self.build_gh_startup_args(),
-            stdout = fp,
-            stderr = fp
+            "loaded graph",
+            label = "otpmanager_graph_build",
+            kill_on_success = True
         )
 
-        print("PID: %d" % self.proc.pid)
-
-        return self.monitor_proc([
-            {
-                "substring": "Exception in thread",
-                "kill_otp": True,
-                "return_value": False,
-                "callback": fp.close
-            },
-            {
-                "substring": "loaded graph",
-                "kill_otp": True,
-                "return_value": True,
-                "callback": fp.close
-            }
-        ])
-
     def start_proc(self, port, dynamically_allocate_ports,
                     port_allocation_range):
         """ Attempts to start a GraphHopper instance
@@ -656,40 +1214,16 @@ class GraphHopperManager(JavaManager):
             True if OTP was succesfully started; False otherwise.
         """
 
-        if (dynamically_allocate_ports):
-            ports = find_ports(port_allocation_range, 2)
-            if (ports):
-                self.port = ports[0]
-            else:
-                print("No ports between %d and %d are available." % (
-                    port_allocation_range[0], port_allocation_range[-1]
-                ))
-                return False
-        else:
-            self.port = port,
-
-        self.proc_output = log_name("otpmanager")
-        fp = open(self.proc_output, "w")
+        # GraphHopper serves plain HTTP only, so a single port is enough;
+        # requesting exactly one means a nearly-full allocation range can
+        # still satisfy us
+        if (not self.allocate_ports(port, dynamically_allocate_ports,
+                                    port_allocation_range, 1)):
+            return False
 
-        self.proc = subprocess.Popen(
+        return self.launch_proc(
             self.build_gh_startup_args(self.port),
-            stdout = fp,
-            stderr = fp
+            "Started server at HTTP",
+            timeout = False
         )
-        print("GraphHopper PID: %d" % self.proc.pid)
-
-        return self.monitor_proc([
-            {
-                "substring": "Exception in thread",
-                "kill_otp": True,
-                "return_value": False,
-                "callback": fp.close
-            },
-            {
-                "substring": "Started server at HTTP",
-                "kill_otp": False,
-                "return_value": True,
-                "callback": fp.close
-            }
-        ], timeout = False)
 